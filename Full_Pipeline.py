@@ -1,13 +1,18 @@
 import lib.Modulerized_Crashes as Cr 
 import lib.Modulerized_Holidays as Holi
+import lib.Modulerized_Statistics as Stats
+import lib.Modulerized_Heatmaps as Heat
+import lib.Modulerized_Profiling as Prof
 import pandas as pd
+import os
 import logging
 import time
+import argparse
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-def main():
-    # Crashes and Collisions Section
+def setup_logging():
+    # configured before anything logs (profiling included) , otherwise basicConfig would do nothing
     try:
         filename_path_logs_crashes= r'logs\Modulerized_Crashes_Holidays_logs.log'
         logging.basicConfig(
@@ -18,10 +23,43 @@ def main():
             )
     except Exception as e :
         logging.error(f"Error Happened for logging : {e}")
-        
+
+
+def main(crashes_path: str = r'assets\Crashes_Collisions_Dataset\Motor_Vehicle_Collisions_Crashes.csv',
+         preview: bool = False, rows_per_stratum: int = 50, seed: int = 42):
     number_of_years = 0
     start_year_input = 2023
 
+    # preview runs work on a stratified sample and keep their outputs away from the full run ones
+    output_dir = r'out\preview' if preview else r'out'
+    os.makedirs(os.path.join(output_dir, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, 'charts'), exist_ok=True)
+
+    # Holidays Section
+    try:
+        """
+            Public Holidays Processing
+            1- Data Bulk Extraction 
+            2- Data Exploration
+            3- Data Cleansing and transformations
+        """
+        logging.info("\n\n\n\n Holidays Data \n")
+        # Data Bulk extraction 
+        logging.info("\n\n\n\n\n\n Data Extraction of Public Holidays")
+        all_holidays = Holi.extract_all_holidays(start_year=start_year_input,num_years=number_of_years)
+        
+        # Data Cleansing and Preparation
+        logging.info("\n\n\n\n\n\n Data Cleansing and Preparation of Public Holidays")
+        cleaned_holidays = Holi.clean_and_transform_holidays(all_holidays)
+
+        minimum_holidays_date = cleaned_holidays['holiday_date'].min()
+        logging.info(f"the minimium date of public holidays is {minimum_holidays_date}")
+
+    except Exception as e :
+        logging.error(f"Error occured during running on data of holidays with reason : {e}")
+
+
+    # Crashes and Collisions Section
     try:
         """
         Crashes and Collisions Processing
@@ -31,11 +69,21 @@ def main():
         """
 
         logging.info("\n\n\n\n Crashes and Collisions Data \n")
-        ## path of collisions file
-        CRASHES_FILE_PATH = r'assets\Crashes_Collisions_Dataset\Motor_Vehicle_Collisions_Crashes.csv'
+        ## path of collisions file(s) , a single CSV , a glob pattern or a manifest listing monthly and correction files
+        CRASHES_FILE_PATH = crashes_path
         # loading collision data
         logging.info("Loading Crashes Data ")
-        df_crashes = Cr.load_crash_data(CRASHES_FILE_PATH)
+        if preview:
+            logging.info("Preview mode , loading a stratified sample of Crashes Data ")
+            df_crashes = Cr.load_crash_data_sample(
+                CRASHES_FILE_PATH,
+                holiday_dates=cleaned_holidays['holiday_date'],
+                rows_per_stratum=rows_per_stratum,
+                min_year=start_year_input - number_of_years,
+                seed=seed
+                )
+        else:
+            df_crashes = Cr.load_crash_data(CRASHES_FILE_PATH)
 
         
         # exploring raw data of crashes 
@@ -60,30 +108,6 @@ def main():
         logging.error(f"Error occured during running data of crashes with reason : {e}")
 
 
-    # Holidays Section
-    try:
-        """
-            Public Holidays Processing
-            1- Data Bulk Extraction 
-            2- Data Exploration
-            3- Data Cleansing and transformations
-        """
-        logging.info("\n\n\n\n Holidays Data \n")
-        # Data Bulk extraction 
-        logging.info("\n\n\n\n\n\n Data Extraction of Public Holidays")
-        all_holidays = Holi.extract_all_holidays(start_year=start_year_input,num_years=number_of_years)
-        
-        # Data Cleansing and Preparation
-        logging.info("\n\n\n\n\n\n Data Cleansing and Preparation of Public Holidays")
-        cleaned_holidays = Holi.clean_and_transform_holidays(all_holidays)
-
-        minimum_holidays_date = cleaned_holidays['holiday_date'].min()
-        logging.info(f"the minimium date of public holidays is {minimum_holidays_date}")
-
-    except Exception as e :
-        logging.error(f"Error occured during running on data of holidays with reason : {e}")
-
-
     ## merging and combining the datasets 
     try :
         """
@@ -109,7 +133,7 @@ def main():
         Cr.explore_crashes_data(merged_df)#,d_columns=list(merged_df.columns)) 
 
         # cleansing and transformations 
-        Cleaned_merged_df = Cr.clean_transform(merged_df)
+        Cleaned_merged_df = Cr.clean_transform(merged_df,location_index_dir=os.path.join(output_dir, 'data', 'location_index'))
         Cleaned_merged_df.drop(columns=['holiday_date','borough','index__borough'],inplace=True)
         Cleaned_merged_df.dropna(subset=['BoroName','longitude','location','latitude'],inplace=True)
 
@@ -124,7 +148,7 @@ def main():
 
 
         # Export Parquet file
-        Cleaned_merged_df.to_parquet(r'out\data\Cleaned_merged_df.parquet')
+        Cleaned_merged_df.to_parquet(rf'{output_dir}\data\Cleaned_merged_df.parquet')
 
         # generate Report with more insights
         
@@ -136,7 +160,7 @@ def main():
         # profile.to_file(r"out\holiday_crashes_profiling_report.html")   
         # chart 1 
 
-        yearly_counts = Cleaned_merged_df['crash_year'].value_counts().sort_index()
+        yearly_counts = Cr.estimated_counts(Cleaned_merged_df, 'crash_year').sort_index()
 
         plt.figure(figsize=(12, 6))
         sns.lineplot(x=yearly_counts.index, y=yearly_counts.values, marker='o', linewidth=2.5)
@@ -146,7 +170,7 @@ def main():
         plt.grid(True, linestyle='--', alpha=0.7)
         plt.xticks(yearly_counts.index)
         plt.tight_layout()
-        plt.savefig(r'out\charts\nyc_collisions_by_year.png', dpi=300, bbox_inches='tight')
+        plt.savefig(rf'{output_dir}\charts\nyc_collisions_by_year.png', dpi=300, bbox_inches='tight')
 
         # Chart 2
 
@@ -154,7 +178,7 @@ def main():
         holiday_crashes_1 = Cleaned_merged_df.dropna(subset=['holiday_name'])
 
         # Group by holiday name
-        holiday_counts_1 = holiday_crashes_1.groupby('holiday_name').size().reset_index(name='collision_count')
+        holiday_counts_1 = Cr.estimated_counts(holiday_crashes_1, 'holiday_name').reset_index(name='collision_count')
 
         # Sort by collision count
         holiday_counts = holiday_counts_1.sort_values(by='collision_count', ascending=False)
@@ -167,7 +191,7 @@ def main():
         plt.ylabel('Holiday')
         plt.grid(axis='x')
         plt.tight_layout()
-        plt.savefig(r'out\charts\nyc_collisions_by_public_holiday.png', dpi=300, bbox_inches='tight')
+        plt.savefig(rf'{output_dir}\charts\nyc_collisions_by_public_holiday.png', dpi=300, bbox_inches='tight')
 
         # Chart 3
 
@@ -175,7 +199,7 @@ def main():
         holiday_crashes_2 = Cleaned_merged_df.dropna(subset=['holiday_name'])
 
         # Group by holiday name and year
-        holiday_yearly_counts = holiday_crashes_2.groupby(['holiday_name', 'crash_year']).size().reset_index(name='collision_count')
+        holiday_yearly_counts = Cr.estimated_counts(holiday_crashes_2, ['holiday_name', 'crash_year']).reset_index(name='collision_count')
 
         # Now, calculate average collisions per holiday
         holiday_avg = holiday_yearly_counts.groupby('holiday_name')['collision_count'].mean().reset_index()
@@ -191,13 +215,19 @@ def main():
         plt.ylabel('Holiday')
         plt.grid(axis='x')
         plt.tight_layout()
-        plt.savefig(r'out\charts\nyc_collisions_by_public_holiday_by_year.png', dpi=300, bbox_inches='tight')
-                
+        plt.savefig(rf'{output_dir}\charts\nyc_collisions_by_public_holiday_by_year.png', dpi=300, bbox_inches='tight')
+
+        # Holiday effect against normal days of the same weekday and month (rate ratios with bootstrap intervals)
+        holiday_effect = Stats.holiday_effect_statistics(Cleaned_merged_df)
+        if not holiday_effect.empty:
+            logging.info(f"\n{holiday_effect[(holiday_effect['borough'] == 'All') & (holiday_effect['severity'] == 'All')]}")
+            holiday_effect.to_csv(rf'{output_dir}\charts\nyc_holiday_effect_statistics.csv', index=False)
+
         # Chart 4 
 
         ### Pandemic Effect around 50% of number of collisions decreased 
 
-        monthly_collisions = Cleaned_merged_df.groupby(['crash_year', 'crash_month'])['collision_id'].count().unstack().fillna(0).astype('Int64')
+        monthly_collisions = Cr.estimated_counts(Cleaned_merged_df, ['crash_year', 'crash_month']).unstack().fillna(0).astype('Int64')
         
         # Reorder months chronologically (instead of alphabetically)
         month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
@@ -205,6 +235,19 @@ def main():
         monthly_collisions = monthly_collisions[month_order]
         logging.info(monthly_collisions)
 
+        # Chart 5
+
+        # Crash density heatmaps rendered from multi-resolution grids instead of the raw points
+        density_grids = Heat.build_density_grids(Cleaned_merged_df)
+        if not density_grids.empty:
+            density_grids.to_parquet(rf'{output_dir}\data\crash_density_grids.parquet', index=False)
+            Heat.render_density_heatmap(density_grids, rf'{output_dir}\charts\nyc_collisions_density_heatmap.png',
+                                        title='NYC Collisions Density')
+            Heat.render_density_heatmap(density_grids, rf'{output_dir}\charts\nyc_casualty_collisions_density_heatmap.png',
+                                        level=2, severity=['Injury', 'Fatal'], title='NYC Collisions with Injuries or Fatalities Density')
+            Heat.render_density_heatmap(density_grids, rf'{output_dir}\charts\nyc_holiday_collisions_density_heatmap.png',
+                                        level=2, is_public_holiday=1, title='NYC Collisions Density on Public Holidays')
+
     
     except Exception as e :
         logging.error(f"There is error in combining the 2 datasets with error {e}")
@@ -212,10 +255,38 @@ def main():
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="NYC Crashes and Public Holidays Pipeline")
+    parser.add_argument('--crashes', default=r'assets\Crashes_Collisions_Dataset\Motor_Vehicle_Collisions_Crashes.csv',
+                        help="crashes CSV , glob pattern (quoted) or manifest .txt listing the files , later files win on overlapping collision_id")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the pipeline stages and write the results into logs/")
+    parser.add_argument('--profile-lines', action='store_true',
+                        help="with --profile , also take line level timings of the stages (needs line_profiler)")
+    parser.add_argument('--profile-top', type=int, default=25,
+                        help="number of hotspots listed for each stage in logs/profile_hotspots.txt")
+    parser.add_argument('--preview', action='store_true',
+                        help="run the whole pipeline on a stratified sample , outputs go into out/preview/")
+    parser.add_argument('--preview-rows-per-stratum', type=int, default=50,
+                        help="rows sampled for each year x month x borough in preview mode")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="seed of the preview sample , the same seed gives the same sample")
+    args = parser.parse_args()
+
+    setup_logging()
+
+    # profiling is only switched on here , a default run calls the functions untouched
+    profiling_session = None
+    if args.profile:
+        profiling_session = Prof.start_profiling(Cr, line_level=args.profile_lines)
 
     # Start timer
     start_time = time.time()
-    main()
+    try:
+        main(crashes_path=args.crashes, preview=args.preview, rows_per_stratum=args.preview_rows_per_stratum, seed=args.seed)
+    finally:
+        # written even when the run is interrupted (Ctrl-C on a slow stage)
+        if profiling_session is not None:
+            Prof.stop_profiling(profiling_session, output_dir='logs', top_n=args.profile_top)
     # End timer
     end_time = time.time()
     # Calculate duration
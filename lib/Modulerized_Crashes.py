@@ -1,4 +1,6 @@
 import os
+import glob
+import time
 import logging
 from datetime import datetime
 import pandas as pd
@@ -7,23 +9,249 @@ from shapely.geometry import Point
 import seaborn as sns 
 import matplotlib.pyplot as plt
 import numpy as np 
-from typing import Optional
+from typing import Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 import re
+import lib.Modulerized_Locations as Loc
 
-def load_crash_data(file_path: str) -> pd.DataFrame:
+# one schema for the key columns whatever each file looks like (a monthly file with no zip codes
+# would otherwise be read as floats and another one as strings)
+CRASH_KEY_DTYPES = {
+    'collision_id': 'Int64',
+    'zip_code': 'string',
+    'borough': 'string',
+    'on_street_name': 'string',
+    'cross_street_name': 'string',
+    'off_street_name': 'string',
+}
+
+# dimensions of the integer stratum key of the preview sampler : borough code x (year * 100 + month) x holiday day (0 for normal days)
+STRATUM_KEY_SHAPE = (2 ** 16, 1_000_000, 32)
+
+def normalize_column_names(columns: pd.Index) -> pd.Index:
+    # (CRASH DATE) -> (crash_date) , the same naming used all over the pipeline
+    return columns.str.replace(' ', '_').str.lower()
+
+
+def resolve_crash_files(file_path: Union[str, list]) -> list:
+    """
+    Turn the crashes input into the ordered list of CSV files to read. It can be :
+        - a list of paths
+        - a manifest (.txt) with one path per line , relative to the manifest folder , # for comments
+        - a glob pattern like assets/Crashes_Collisions_Dataset/*.csv (files sorted by name)
+        - a single CSV path
+    The order matters , on overlapping collision_id the later file wins.
+    """
+    if isinstance(file_path, (list, tuple)):
+        return list(file_path)
+    if file_path.lower().endswith('.txt'):
+        manifest_dir = os.path.dirname(file_path)
+        with open(file_path) as manifest:
+            lines = [line.strip() for line in manifest]
+        return [os.path.join(manifest_dir, line) for line in lines if line and not line.startswith('#')]
+    if any(character in file_path for character in '*?['):
+        return sorted(glob.glob(file_path))
+    return [file_path]
+
+
+def crash_key_dtypes(file_path: str) -> dict:
+    # CRASH_KEY_DTYPES keyed by the raw column names of this file (COLLISION_ID , ZIP CODE ...) for read_csv
+    header = pd.read_csv(file_path, nrows=0).columns
+    return {column: CRASH_KEY_DTYPES[name] for column, name in zip(header, normalize_column_names(header)) if name in CRASH_KEY_DTYPES}
+
+
+def read_crash_file(file_path: str) -> Tuple[pd.DataFrame, float]:
+    # reading one file of a multi file extract into the common column names , returning the seconds it took
+    start = time.perf_counter()
+    df = pd.read_csv(file_path, dtype=crash_key_dtypes(file_path), low_memory=False)
+    df.columns = normalize_column_names(df.columns)
+    return df, time.perf_counter() - start
+
+
+def load_crash_data(file_path: Union[str, list], max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Load the crashes from one CSV or from several files (monthly exports plus correction files)
+    given as a list , a manifest or a glob (see resolve_crash_files).
+
+    The files are read concurrently by a thread pool (the pandas CSV parser does most
+    of its work without holding the GIL) into the common column names , then combined so
+    that for an overlapping collision_id the last row (of the last file) wins.
+
+    Args:
+        file_path: CSV path , glob pattern , manifest or list of paths
+        max_workers: number of reading threads (default: chosen by ThreadPoolExecutor)
+    """
     try:
         logging.info("new run")
-        df = pd.read_csv(file_path,low_memory=False)
-        logging.info("Crash data loaded successfully.")
+        files = resolve_crash_files(file_path)
+        if not files:
+            raise FileNotFoundError(f"No crashes files found for {file_path}")
+
+        # a single file goes through the same path , it may carry its own corrections too
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(read_crash_file, files))
+
+        for path, (frame, seconds) in zip(files, results):
+            megabytes = os.path.getsize(path) / 1024 ** 2
+            seconds = max(seconds, 1e-9)
+            logging.info(f"{path} : {len(frame)} rows , {megabytes:.1f} MB in {seconds:.2f} seconds ({len(frame) / seconds:.0f} rows/s , {megabytes / seconds:.1f} MB/s)")
+
+        df = pd.concat([frame for frame, _ in results], ignore_index=True)
+        rows_before = len(df)
+        # the later rows are corrections of the earlier ones , keeping the last row of each collision
+        # rows without collision_id are not the same crash , they are all kept
+        duplicated = df['collision_id'].notna() & df.duplicated(subset='collision_id', keep='last')
+        df = df[~duplicated].reset_index(drop=True)
+        logging.info(f"{rows_before - len(df)} overlapping collision_id are resolved with the last row")
+
+        logging.info(f"Crash data loaded successfully from {len(files)} files with {len(df)} rows in {time.perf_counter() - start:.2f} seconds.")
         return df
     
     except Exception as e:
         logging.error(f"This logging for function called (load_crash_data) - Unexpected error for loading crashes data : {e}")
 
 
+def last_occurrence_masks(files: list) -> list:
+    """
+    For each file , a boolean per row telling if it is the last row of its collision_id over all the files ,
+    only the collision_id column is read so the preview keeps the last-row-wins rule of load_crash_data.
+    Rows without collision_id are always kept.
+    """
+    id_columns = [
+        pd.read_csv(
+            path,
+            usecols=lambda column: column.replace(' ', '_').lower() == 'collision_id',
+            dtype=crash_key_dtypes(path)
+            ).iloc[:, 0]
+        for path in files
+    ]
+    ids = pd.concat(id_columns, ignore_index=True)
+    keep = ~(ids.notna() & ids.duplicated(keep='last')).to_numpy()
+    return np.split(keep, np.cumsum([len(ids) for ids in id_columns])[:-1])
+
+
+def load_crash_data_sample(
+    file_path: Union[str, list],
+    holiday_dates: Optional[list] = None,
+    rows_per_stratum: int = 50,
+    holiday_multiplier: int = 5,
+    min_year: Optional[int] = None,
+    seed: int = 42,
+    chunksize: int = 250_000
+    ) -> pd.DataFrame:
+    """
+    Load a reproducible stratified sample of the crashes for preview runs , streaming the CSV in chunks
+    so the whole file is never held in memory.
+
+    The strata are year x month x borough , every holiday date gets its own strata with a bigger
+    reservoir so holidays are over-represented. Each stratum is a reservoir keeping the rows with the
+    smallest random priorities , which is a uniform sample of the rows streamed through it.
+
+    Args:
+        file_path: CSV path , glob pattern , manifest or list of paths (see resolve_crash_files) ,
+                   the files are streamed one after the other and on overlapping collision_id only the last row is sampled
+        holiday_dates: public holiday dates to over-represent (default: none)
+        rows_per_stratum: rows kept for each year x month x borough (default: 50)
+        holiday_multiplier: how many times bigger the reservoir of a holiday stratum is (default: 5)
+        min_year: skip the crashes before this year (default: keep all)
+        seed: seed of the random priorities so the same sample comes back on each run (default: 42)
+        chunksize: number of rows read from the CSV at once (default: 250000)
+
+    Returns:
+        DataFrame of the sampled crashes with a sample_weight column (population rows / sampled rows of its stratum)
+    """
+    try:
+        logging.info("new preview run")
+        rng = np.random.default_rng(seed)
+        holiday_dates = pd.DatetimeIndex(pd.to_datetime(holiday_dates if holiday_dates is not None else [])).normalize()
+        reservoir = None
+        population_counts = []
+        rows_read = 0
+        columns = None
+        # borough codes growing as new boroughs show up so the same borough has the same code in every chunk
+        borough_codes = {}
+
+        files = resolve_crash_files(file_path)
+        if not files:
+            raise FileNotFoundError(f"No crashes files found for {file_path}")
+        keep_masks = last_occurrence_masks(files)
+
+        chunks = (
+            (chunk, keep[offset:offset + len(chunk)])
+            for path, keep in zip(files, keep_masks)
+            for offset, chunk in zip(range(0, len(keep), chunksize), pd.read_csv(path, dtype=crash_key_dtypes(path), low_memory=False, chunksize=chunksize))
+        )
+        for chunk, chunk_keep in chunks:
+            rows_read += len(chunk)
+            # rows redefined later (corrections) are skipped so they are neither counted nor sampled twice
+            chunk = chunk[chunk_keep]
+            # files of a multi file extract may name the columns differently so they are normalized first
+            chunk.columns = normalize_column_names(chunk.columns)
+            columns = chunk.columns
+            crash_date = pd.to_datetime(chunk['crash_date']).dt.normalize()
+            # crashes without a date have no stratum , they were never sampled
+            chunk = chunk[crash_date.notna()]
+            crash_date = crash_date[crash_date.notna()]
+            if min_year is not None:
+                chunk = chunk[crash_date.dt.year >= min_year]
+                crash_date = crash_date[crash_date.dt.year >= min_year]
+            if chunk.empty:
+                continue
+
+            borough = chunk['borough'].fillna('UNKNOWN').astype(str)
+            for name in borough.unique():
+                borough_codes.setdefault(name, len(borough_codes))
+            is_holiday = crash_date.isin(holiday_dates)
+            # integer stratum keys , cheaper to build , sort and group than formatted date strings
+            stratum = np.ravel_multi_index((
+                borough.map(borough_codes).to_numpy(dtype='int64'),
+                (crash_date.dt.year * 100 + crash_date.dt.month).to_numpy(dtype='int64'),
+                np.where(is_holiday, crash_date.dt.day, 0)
+                ), STRATUM_KEY_SHAPE)
+            chunk = chunk.assign(
+                _stratum=stratum,
+                _capacity=np.where(is_holiday, rows_per_stratum * holiday_multiplier, rows_per_stratum),
+                _priority=rng.random(len(chunk))
+            )
+            population_counts.append(chunk['_stratum'].value_counts())
+
+            # keeping the smallest priorities of each stratum among the old reservoir and the new chunk
+            candidates = chunk if reservoir is None else pd.concat([reservoir, chunk], ignore_index=True)
+            candidates = candidates.sort_values('_priority', kind='stable')
+            reservoir = candidates[candidates.groupby('_stratum').cumcount() < candidates['_capacity']]
+
+        if not population_counts:
+            # every row was filtered out (min_year , corrections) , an empty frame keeps the columns for the next steps
+            logging.warning(f"No crashes left to sample from {file_path} with min_year {min_year}")
+            return pd.DataFrame(columns=list(columns if columns is not None else []) + ['sample_weight'])
+
+        population_counts = pd.concat(population_counts).groupby(level=0).sum()
+        sample_counts = reservoir['_stratum'].value_counts()
+        reservoir = reservoir.assign(sample_weight=reservoir['_stratum'].map(population_counts / sample_counts))
+        df = reservoir.drop(columns=['_stratum', '_capacity', '_priority']).reset_index(drop=True)
+
+        logging.info(f"Preview sample of {len(df)} crashes drawn from {rows_read} rows over {len(sample_counts)} strata")
+        logging.info(f"Boroughs of the strata : {list(borough_codes)}")
+        return df
+
+    except Exception as e:
+        logging.error(f"This logging for function called (load_crash_data_sample) - Unexpected error for sampling crashes data : {e}")
+
+
+def estimated_counts(df: pd.DataFrame, by) -> pd.Series:
+    """
+    Number of crashes grouped by the given columns , on preview samples the counts are scaled
+    back to population estimates by summing the sample_weight column instead of counting rows.
+    """
+    if 'sample_weight' in df.columns:
+        return df.groupby(by, observed=True)['sample_weight'].sum().round().astype('int64')
+    return df.groupby(by, observed=True).size()
+
+
 def explore_crashes_data(df: pd.DataFrame,d_columns: list = None) -> pd.DataFrame:
     try:
         logging.info("Data preview:")
@@ -67,7 +295,7 @@ def preparing_crashes_data(df_crashes: pd.DataFrame,start_year: int = datetime.n
     try:
        
         ## columns names after formating
-        df_crashes.columns = df_crashes.columns.str.replace(' ', '_').str.lower()
+        df_crashes.columns = normalize_column_names(df_crashes.columns)
         logging.info(f"Columns are reformatted successfully!")
         ## date formatting
         df_crashes['crash_date'] = pd.to_datetime(df_crashes['crash_date']).dt.normalize()
@@ -183,7 +411,7 @@ def replace_numeric_with_nan(value):
 
 
 
-def clean_transform(df_crashes:pd.DataFrame) ->  pd.DataFrame:
+def clean_transform(df_crashes:pd.DataFrame,location_index_dir: str = r'out\data\location_index') ->  pd.DataFrame:
     try:
         
         df_crashes= df_crashes.copy()
@@ -210,6 +438,15 @@ def clean_transform(df_crashes:pd.DataFrame) ->  pd.DataFrame:
 
 
         # Location 
+        # offline imputation of coordinates from street intersections and borough from zip code
+        # built from the dataset itself and kept between runs into location_index_dir
+        try:
+            location_index = Loc.update_location_index(df_crashes, location_index_dir)
+            if location_index is not None:
+                df_crashes = Loc.impute_missing_locations(df_crashes, location_index)
+        except Exception as e :
+            logging.error(f"Error occured during offline location imputation : {e}")
+
         logging.info("starting Geographical imputations ")
         # Locations imputations for Borough , and  location 
         # Generate new columns to fill most of missing Borough data
@@ -220,6 +457,8 @@ def clean_transform(df_crashes:pd.DataFrame) ->  pd.DataFrame:
             lon_col='longitude',
             lat_col='latitude'
             )
+        # borough reported with the crash (or imputed from zip code) for points which did not fall inside any boundary
+        df_crashes['BoroName'] = df_crashes['BoroName'].fillna(df_crashes['borough'].astype('object').str.title())
         logging.info("Geographical Imputed successfully!")
         
         #removing invalid coordinates records like (0.0,0.0)
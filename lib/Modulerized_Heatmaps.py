@@ -0,0 +1,132 @@
+import logging
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+import lib.Modulerized_Locations as Loc
+
+# level 0 is the finest grid , every next level doubles the cell size (4 cells merged into 1)
+FINEST_CELL_DEGREES = 0.0005
+NUMBER_OF_LEVELS = 6
+
+
+def grid_shape(cell_degrees: float) -> tuple:
+    # number of (rows , cols) needed to cover the NYC bounding box with this cell size
+    n_rows = int(np.ceil((Loc.NYC_LATITUDE_RANGE[1] - Loc.NYC_LATITUDE_RANGE[0]) / cell_degrees))
+    n_cols = int(np.ceil((Loc.NYC_LONGITUDE_RANGE[1] - Loc.NYC_LONGITUDE_RANGE[0]) / cell_degrees))
+    return n_rows, n_cols
+
+
+def build_density_grids(
+    df: pd.DataFrame,
+    finest_cell_degrees: float = FINEST_CELL_DEGREES,
+    n_levels: int = NUMBER_OF_LEVELS
+    ) -> pd.DataFrame:
+    """
+    Bin the crash coordinates into a hierarchy of grids with counts by severity and holiday flag.
+
+    The points are binned once into integer cells of the finest grid , the coarser levels
+    are taken by shifting those integers so no coordinate is binned twice.
+    Only the non empty cells are kept (sparse grid).
+
+    Args:
+        df: cleaned and merged crashes DataFrame (latitude , longitude , severity , is_public_holiday)
+        finest_cell_degrees: cell size of level 0 in degrees (default: 0.0005 , around 50 meters)
+        n_levels: number of levels in the hierarchy (default: 6)
+
+    Returns:
+        DataFrame with columns level , cell_degrees , row , col , severity , is_public_holiday , crash_count
+    """
+    try:
+        valid = Loc.valid_coordinates_mask(df) & df['severity'].notna()
+        latitude = df.loc[valid, 'latitude'].to_numpy(dtype=float)
+        longitude = df.loc[valid, 'longitude'].to_numpy(dtype=float)
+        rows = ((latitude - Loc.NYC_LATITUDE_RANGE[0]) / finest_cell_degrees).astype(np.int64)
+        cols = ((longitude - Loc.NYC_LONGITUDE_RANGE[0]) / finest_cell_degrees).astype(np.int64)
+        # points lying exactly on the upper edge of the bounding box go into the last cell
+        finest_rows, finest_cols = grid_shape(finest_cell_degrees)
+        rows = np.minimum(rows, finest_rows - 1)
+        cols = np.minimum(cols, finest_cols - 1)
+        severity_codes, severities = pd.factorize(df.loc[valid, 'severity'].astype('object'), sort=True)
+        holiday = df.loc[valid, 'is_public_holiday'].to_numpy().astype(np.int64)
+        # preview samples are counted with their weights so the grids estimate the full data
+        weights = df.loc[valid, 'sample_weight'].to_numpy(dtype=float) if 'sample_weight' in df.columns else None
+
+        grids = []
+        for level in range(n_levels):
+            cell_degrees = finest_cell_degrees * 2 ** level
+            n_rows, n_cols = grid_shape(cell_degrees)
+            shape = (n_rows, n_cols, len(severities), 2)
+
+            # one integer per (cell , severity , holiday) then counting the distinct ones
+            keys = np.ravel_multi_index((rows >> level, cols >> level, severity_codes, holiday), shape)
+            cells, cell_codes = np.unique(keys, return_inverse=True)
+            crash_count = np.rint(np.bincount(cell_codes, weights=weights))
+            level_rows, level_cols, level_severity, level_holiday = np.unravel_index(cells, shape)
+
+            grids.append(pd.DataFrame({
+                'level': np.int8(level),
+                'cell_degrees': np.float32(cell_degrees),
+                'row': level_rows.astype(np.int16),
+                'col': level_cols.astype(np.int16),
+                'severity': pd.Categorical.from_codes(level_severity, categories=severities),
+                'is_public_holiday': level_holiday.astype(np.int8),
+                'crash_count': crash_count.astype(np.int32),
+            }))
+            logging.info(f"Density grid level {level} ({cell_degrees} degrees) has {len(cells)} non empty cells")
+
+        return pd.concat(grids, ignore_index=True)
+
+    except Exception as e :
+        logging.error(f"Error occured during executing function (build_density_grids) : {e}")
+        return pd.DataFrame()
+
+
+def render_density_heatmap(
+    grids: pd.DataFrame,
+    output_path: str,
+    level: int = 1,
+    severity: list = None,
+    is_public_holiday: int = None,
+    title: str = 'NYC Collisions Density'
+    ):
+    """
+    Render a heatmap image from one level of the precomputed grids instead of the raw points.
+
+    Args:
+        grids: DataFrame returned by build_density_grids
+        output_path: where to save the image
+        level: grid level to render , 0 is the finest (default: 1)
+        severity: keep only these severities (default: all)
+        is_public_holiday: keep only holidays (1) or normal days (0) (default: both)
+        title: title of the chart
+    """
+    try:
+        cells = grids[grids['level'] == level]
+        if severity:
+            cells = cells[cells['severity'].isin(severity)]
+        if is_public_holiday is not None:
+            cells = cells[cells['is_public_holiday'] == is_public_holiday]
+
+        cell_degrees = float(grids.loc[grids['level'] == level, 'cell_degrees'].iloc[0])
+        n_rows, n_cols = grid_shape(cell_degrees)
+        density = np.zeros((n_rows, n_cols))
+        np.add.at(density, (cells['row'].to_numpy(), cells['col'].to_numpy()), cells['crash_count'].to_numpy())
+
+        extent = [
+            Loc.NYC_LONGITUDE_RANGE[0], Loc.NYC_LONGITUDE_RANGE[0] + n_cols * cell_degrees,
+            Loc.NYC_LATITUDE_RANGE[0], Loc.NYC_LATITUDE_RANGE[0] + n_rows * cell_degrees
+        ]
+        plt.figure(figsize=(12, 10))
+        plt.imshow(np.ma.masked_equal(density, 0), origin='lower', extent=extent, cmap='inferno', norm=LogNorm(), aspect='auto')
+        plt.colorbar(label='Number of Collisions')
+        plt.title(title, fontsize=16)
+        plt.xlabel('Longitude', fontsize=14)
+        plt.ylabel('Latitude', fontsize=14)
+        plt.tight_layout()
+        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        plt.close()
+        logging.info(f"Heatmap of level {level} saved into {output_path}")
+
+    except Exception as e :
+        logging.error(f"Error occured during executing function (render_density_heatmap) : {e}")
@@ -0,0 +1,296 @@
+import os
+import logging
+import pandas as pd
+import numpy as np
+from typing import Tuple
+
+# rough bounding box of the five boroughs , coordinates outside it (like (0.0, 0.0)) are treated as missing
+NYC_LATITUDE_RANGE = (40.45, 40.95)
+NYC_LONGITUDE_RANGE = (-74.30, -73.65)
+
+INTERSECTIONS_INDEX_FILE = 'intersections.parquet'
+ZIP_BOROUGHS_INDEX_FILE = 'zip_boroughs.parquet'
+INDEXED_CRASHES_FILE = 'indexed_crashes.parquet'
+
+# sums kept per borough x intersection , additive so a corrected crash can be taken out exactly
+INTERSECTION_SUMS = ['sum_lat', 'sum_lon', 'sum_lat2', 'sum_lon2', 'n']
+# intersections whose observations are spread more than this (in degrees , around 500 meters) are not used
+MAX_SPREAD_DEGREES = 0.005
+
+# fields the index is built from , a crash is folded in again when one of them changes (correction files)
+LOCATION_FIELDS = ['on_street_name', 'cross_street_name', 'zip_code', 'borough', 'latitude', 'longitude']
+
+# the same street is written in many ways (EAST 14 STREET / E 14th st ...) so we reduce them to one spelling
+STREET_ABBREVIATIONS = {
+    r'\bAVENUE\b': 'AVE',
+    r'\bSTREET\b': 'ST',
+    r'\bROAD\b': 'RD',
+    r'\bBOULEVARD\b': 'BLVD',
+    r'\bPLACE\b': 'PL',
+    r'\bPARKWAY\b': 'PKWY',
+    r'\bEXPRESSWAY\b': 'EXPY',
+    r'\bDRIVE\b': 'DR',
+    r'\bLANE\b': 'LN',
+    r'\bCOURT\b': 'CT',
+    r'\bEAST\b': 'E',
+    r'\bWEST\b': 'W',
+    r'\bNORTH\b': 'N',
+    r'\bSOUTH\b': 'S',
+}
+
+
+def valid_coordinates_mask(df: pd.DataFrame, lon_col: str = 'longitude', lat_col: str = 'latitude') -> pd.Series:
+    """
+    True for rows whose coordinates are present and fall inside the NYC bounding box.
+    """
+    latitude = pd.to_numeric(df[lat_col], errors='coerce')
+    longitude = pd.to_numeric(df[lon_col], errors='coerce')
+    return (latitude.between(*NYC_LATITUDE_RANGE) & longitude.between(*NYC_LONGITUDE_RANGE))
+
+
+def normalize_street_names(series: pd.Series) -> np.ndarray:
+    """
+    Normalize street names into one spelling , missing names become empty strings.
+    The regex work is done once per distinct name and mapped back with the factorized codes,
+    so the cost depends on the number of distinct streets instead of the number of crashes.
+    """
+    codes, uniques = pd.factorize(series)
+    names = pd.Series(uniques, dtype='string').str.upper()
+    names = names.str.replace(r'[^\w\s]', ' ', regex=True)
+    # 14TH -> 14 , 1ST -> 1
+    names = names.str.replace(r'\b(\d+)(ST|ND|RD|TH)\b', r'\1', regex=True)
+    for pattern, abbreviation in STREET_ABBREVIATIONS.items():
+        names = names.str.replace(pattern, abbreviation, regex=True)
+    names = names.str.replace(r'\s+', ' ', regex=True).str.strip().fillna('')
+
+    # code -1 is a missing value , it takes the extra empty string at the end
+    lookup = np.append(names.to_numpy(dtype=object), '')
+    return lookup[codes]
+
+
+def intersection_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Build an order-insensitive key for every on_street_name x cross_street_name pair
+    (A & B is the same intersection as B & A) , rows without both streets get None.
+    """
+    on_street = normalize_street_names(df['on_street_name'])
+    cross_street = normalize_street_names(df['cross_street_name'])
+
+    swap = on_street > cross_street
+    first = np.where(swap, cross_street, on_street)
+    second = np.where(swap, on_street, cross_street)
+
+    keys = pd.Series(first, index=df.index, dtype=object) + ' & ' + second
+    keys[(on_street == '') | (cross_street == '')] = None
+    return keys
+
+
+def normalize_zip_codes(series: pd.Series) -> pd.Series:
+    # zip codes come as strings , floats (11208.0) or blanks so we keep only the 5 digits
+    return series.astype('string').str.extract(r'(\d{5})', expand=False)
+
+
+def normalize_boroughs(series: pd.Series) -> pd.Series:
+    # (Brooklyn / BROOKLYN / brooklyn ) -> BROOKLYN , missing boroughs become empty strings
+    return series.astype('string').str.strip().str.upper().fillna('')
+
+
+def location_fingerprints(df: pd.DataFrame) -> pd.Series:
+    # one hash per crash of the fields used by the index , to notice corrected crashes reusing a collision_id
+    return pd.util.hash_pandas_object(df[LOCATION_FIELDS].astype('string'), index=False)
+
+
+def location_contributions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    What every crash adds to the index , kept per collision_id so a corrected crash can take
+    its previous version out of the index before the new one is added.
+    intersection_key / latitude / longitude are empty when the crash has no valid coordinates.
+    """
+    valid = valid_coordinates_mask(df)
+    return pd.DataFrame({
+        'collision_id': df['collision_id'].astype('int64').to_numpy(),
+        'fingerprint': location_fingerprints(df).to_numpy(),
+        'borough': normalize_boroughs(df['borough']).to_numpy(dtype=object),
+        'intersection_key': intersection_keys(df).where(valid).to_numpy(dtype=object),
+        'latitude': pd.to_numeric(df['latitude'], errors='coerce').where(valid).to_numpy(dtype=float),
+        'longitude': pd.to_numeric(df['longitude'], errors='coerce').where(valid).to_numpy(dtype=float),
+        'zip_code': normalize_zip_codes(df['zip_code']).to_numpy(dtype=object),
+    })
+
+
+def aggregate_contributions(contributions: pd.DataFrame, sign: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Turn crash contributions into index sums , sign=-1 gives the sums to take them out again.
+
+    Returns:
+        intersections: borough x intersection_key -> sums of latitude , longitude , their squares and n
+                       (borough is '' when the crash had none) , all additive so they can be added or removed exactly
+        zip_boroughs: zip_code x borough -> number of observations (n)
+    """
+    located = contributions.dropna(subset=['intersection_key'])
+    intersections = located.assign(
+        sum_lat=located['latitude'] * sign,
+        sum_lon=located['longitude'] * sign,
+        sum_lat2=located['latitude'] ** 2 * sign,
+        sum_lon2=located['longitude'] ** 2 * sign,
+        n=sign
+    ).groupby(['borough', 'intersection_key'])[INTERSECTION_SUMS].sum().reset_index()
+
+    zips = contributions[contributions['zip_code'].notna() & (contributions['borough'] != '')]
+    zip_boroughs = zips.assign(n=sign).groupby(['zip_code', 'borough'])['n'].sum().reset_index()
+
+    return intersections, zip_boroughs
+
+
+def merge_location_index(indexes: list) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Add up several (intersections, zip_boroughs) sums , keys left without observations are dropped.
+    """
+    intersections = pd.concat([index[0] for index in indexes], ignore_index=True) \
+        .groupby(['borough', 'intersection_key'])[INTERSECTION_SUMS].sum().reset_index()
+    zip_boroughs = pd.concat([index[1] for index in indexes], ignore_index=True) \
+        .groupby(['zip_code', 'borough'])['n'].sum().reset_index()
+    return intersections[intersections['n'] > 0], zip_boroughs[zip_boroughs['n'] > 0]
+
+
+def update_location_index(df: pd.DataFrame, index_dir: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Load the persisted location index from index_dir , add the crashes which were not indexed
+    in previous runs and save it back.
+
+    The index keeps the contribution of every indexed crash by collision_id with a fingerprint of
+    its location fields , so a run over a wider year window still adds the older crashes and a
+    corrected crash reusing its collision_id replaces its previous version in the sums.
+
+    Args:
+        df: crashes DataFrame with the formatted column names
+        index_dir: folder holding the index parquet files and the indexed crashes
+
+    Returns:
+        the up to date (intersections, zip_boroughs) index
+    """
+    intersections_path = os.path.join(index_dir, INTERSECTIONS_INDEX_FILE)
+    zip_boroughs_path = os.path.join(index_dir, ZIP_BOROUGHS_INDEX_FILE)
+    indexed_crashes_path = os.path.join(index_dir, INDEXED_CRASHES_FILE)
+
+    # crashes without collision_id cannot be tracked , they are left out of the index only
+    with_id = df['collision_id'].notna()
+    if not with_id.all():
+        logging.warning(f"{(~with_id).sum()} crashes without collision_id are not added to the location index")
+    contributions = location_contributions(df[with_id]).drop_duplicates(subset='collision_id', keep='last')
+
+    index = None
+    indexed_crashes = contributions.iloc[:0]
+    if os.path.exists(intersections_path) and os.path.exists(zip_boroughs_path) and os.path.exists(indexed_crashes_path):
+        index = (pd.read_parquet(intersections_path), pd.read_parquet(zip_boroughs_path))
+        indexed_crashes = pd.read_parquet(indexed_crashes_path)
+        # index files written by an older layout (medians only) are rebuilt from scratch
+        if not set(INTERSECTION_SUMS).issubset(index[0].columns) or 'intersection_key' not in indexed_crashes.columns:
+            logging.warning(f"Location index in {index_dir} has an old layout , it is rebuilt")
+            index = None
+            indexed_crashes = contributions.iloc[:0]
+        else:
+            logging.info(f"Location index loaded with {len(index[0])} intersections and {len(index[1])} zip codes x boroughs built from {len(indexed_crashes)} crashes")
+
+    # a crash is new when its (collision_id , fingerprint) pair was never indexed
+    already_indexed = pd.MultiIndex.from_frame(contributions[['collision_id', 'fingerprint']]) \
+        .isin(pd.MultiIndex.from_frame(indexed_crashes[['collision_id', 'fingerprint']]))
+    new_contributions = contributions[~already_indexed]
+    replaced = indexed_crashes['collision_id'].isin(new_contributions['collision_id'])
+    logging.info(f"{len(new_contributions)} crashes are added to the location index , {replaced.sum()} of them replace a previous version")
+
+    if new_contributions.empty:
+        return index
+
+    parts = [aggregate_contributions(new_contributions), aggregate_contributions(indexed_crashes[replaced], sign=-1)]
+    if index is not None:
+        parts.append(index)
+    index = merge_location_index(parts)
+    indexed_crashes = pd.concat([indexed_crashes[~replaced], new_contributions], ignore_index=True)
+
+    os.makedirs(index_dir, exist_ok=True)
+    index[0].to_parquet(intersections_path, index=False)
+    index[1].to_parquet(zip_boroughs_path, index=False)
+    indexed_crashes.to_parquet(indexed_crashes_path, index=False)
+    logging.info(f"Location index saved into {index_dir} with {len(index[0])} intersections and {len(index[1])} zip codes x boroughs built from {len(indexed_crashes)} crashes")
+
+    return index
+
+
+def coordinate_statistics(sums: pd.DataFrame) -> pd.DataFrame:
+    # mean coordinates and their spread (standard distance in degrees) from the index sums
+    latitude = sums['sum_lat'] / sums['n']
+    longitude = sums['sum_lon'] / sums['n']
+    variance = (sums['sum_lat2'] / sums['n'] - latitude ** 2).clip(lower=0) \
+        + (sums['sum_lon2'] / sums['n'] - longitude ** 2).clip(lower=0)
+    return sums.assign(latitude=latitude, longitude=longitude, spread=np.sqrt(variance))
+
+
+def lookup_positions(table_keys: pd.Series, keys: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # hash lookup of keys into the (unique) table keys , returning the found positions in keys and the matching table rows
+    positions = pd.Index(table_keys).get_indexer(keys)
+    found = np.flatnonzero(positions >= 0)
+    return found, positions[found]
+
+
+def impute_missing_locations(df: pd.DataFrame, index: Tuple[pd.DataFrame, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Fill missing borough from the zip code index , then missing or invalid latitude / longitude / location
+    from the intersection index , using hash lookups on the whole column at once.
+
+    The same street pair exists in several boroughs (3 AVE & 86 ST) so coordinates are looked up by
+    borough x intersection first , and by intersection only when all its observations are in one borough.
+    Keys whose observations are spread more than MAX_SPREAD_DEGREES are never used.
+
+    Args:
+        df: crashes DataFrame with the formatted column names
+        index: (intersections, zip_boroughs) as returned by update_location_index
+
+    Returns:
+        the same DataFrame with the imputed values
+    """
+    intersections, zip_boroughs = index
+
+    # borough from the zip code , taking the borough most reported for each zip code
+    borough_is_category = isinstance(df['borough'].dtype, pd.CategoricalDtype)
+    df['borough'] = df['borough'].astype('object')
+    missing_borough = df['borough'].isna()
+    zip_to_borough = zip_boroughs.sort_values('n', ascending=False).drop_duplicates('zip_code')
+    zip_codes = normalize_zip_codes(df.loc[missing_borough, 'zip_code'])
+    found, table_rows = lookup_positions(zip_to_borough['zip_code'], zip_codes)
+    df.loc[zip_codes.index[found], 'borough'] = zip_to_borough['borough'].to_numpy()[table_rows]
+    if borough_is_category:
+        df['borough'] = df['borough'].astype('category')
+    logging.info(f"Borough is imputed for {len(found)} out of {missing_borough.sum()} crashes without borough")
+
+    # coordinates from the street intersection within the borough
+    missing_coordinates = ~valid_coordinates_mask(df)
+    keys = intersection_keys(df.loc[missing_coordinates])
+    boroughs = normalize_boroughs(df.loc[missing_coordinates, 'borough'])
+    latitude = np.full(len(keys), np.nan)
+    longitude = np.full(len(keys), np.nan)
+
+    by_borough = coordinate_statistics(intersections[intersections['borough'] != ''])
+    by_borough = by_borough[by_borough['spread'] <= MAX_SPREAD_DEGREES]
+    found, table_rows = lookup_positions(by_borough['borough'] + ' | ' + by_borough['intersection_key'], boroughs + ' | ' + keys)
+    latitude[found] = by_borough['latitude'].to_numpy()[table_rows]
+    longitude[found] = by_borough['longitude'].to_numpy()[table_rows]
+
+    # street pair only , when every observation of it is in a single borough
+    street_only = intersections.assign(known_borough=(intersections['borough'] != '').astype(int)) \
+        .groupby('intersection_key')[INTERSECTION_SUMS + ['known_borough']].sum().reset_index()
+    street_only = coordinate_statistics(street_only)
+    street_only = street_only[(street_only['known_borough'] <= 1) & (street_only['spread'] <= MAX_SPREAD_DEGREES)]
+    not_found = np.isnan(latitude)
+    found, table_rows = lookup_positions(street_only['intersection_key'], keys[not_found])
+    latitude[np.flatnonzero(not_found)[found]] = street_only['latitude'].to_numpy()[table_rows]
+    longitude[np.flatnonzero(not_found)[found]] = street_only['longitude'].to_numpy()[table_rows]
+
+    imputed = ~np.isnan(latitude)
+    rows = keys.index[imputed]
+    df.loc[rows, 'latitude'] = latitude[imputed]
+    df.loc[rows, 'longitude'] = longitude[imputed]
+    df.loc[rows, 'location'] = '(' + pd.Series(latitude[imputed], index=rows).astype(str) + ', ' + pd.Series(longitude[imputed], index=rows).astype(str) + ')'
+    logging.info(f"Coordinates are imputed for {imputed.sum()} out of {missing_coordinates.sum()} crashes without valid coordinates")
+
+    return df
@@ -0,0 +1,178 @@
+import os
+import io
+import sys
+import time
+import cProfile
+import pstats
+import logging
+import functools
+import threading
+from collections import defaultdict, Counter
+
+# pipeline functions of lib/Modulerized_Crashes.py profiled as stages when running with --profile
+PROFILED_STAGES = [
+    'load_crash_data',
+    'load_crash_data_sample',
+    'preparing_crashes_data',
+    'clean_transform',
+    'geographical_manipulating',
+    'create_data_model',
+]
+
+
+class StackSampler:
+    """
+    Sampling profiler , a background thread reads the stacks of every thread every interval
+    (the main thread and the ingest workers of load_crash_data) and counts them in the collapsed
+    format used by flamegraph.pl and speedscope , each stack starting with its thread name.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StackSampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write(f"{stack} {count}\n")
+
+
+def profile_stage(session: dict, stage: str, function):
+    """
+    Wrap one pipeline function , measuring its wall time on every call and recording a
+    deterministic (cProfile) profile of it. A stage called inside another profiled stage
+    (geographical_manipulating inside clean_transform) is timed and shows up inside the outer profile.
+    cProfile only follows the calling thread , the work of the ingest worker threads is in the sampled stacks.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = None
+        if not session['active']:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        session['active'].append(stage)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            session['timings'][stage].append(time.perf_counter() - start)
+            session['active'].pop()
+            if profiler is not None:
+                profiler.disable()
+                if stage in session['stats']:
+                    session['stats'][stage].add(profiler)
+                else:
+                    session['stats'][stage] = pstats.Stats(profiler)
+
+    return wrapper
+
+
+def start_profiling(module, stages: list = PROFILED_STAGES, line_level: bool = False, sampling_interval: float = 0.005) -> dict:
+    """
+    Patch the stage functions of module with profiled versions and start the stack sampler.
+    Nothing is patched in a default run so it keeps its normal overhead.
+
+    Args:
+        module: module holding the pipeline functions (lib.Modulerized_Crashes)
+        stages: names of the functions to profile (default: PROFILED_STAGES)
+        line_level: also take line by line timings of the stages , needs the line_profiler package
+        sampling_interval: seconds between 2 stack samples (default: 0.005)
+
+    Returns:
+        profiling session to pass to stop_profiling
+    """
+    session = {
+        'module': module,
+        'originals': {},
+        'stats': {},
+        'timings': defaultdict(list),
+        'active': [],
+        'line_profiler': None,
+        'sampler': StackSampler(sampling_interval),
+    }
+
+    if line_level:
+        try:
+            from line_profiler import LineProfiler
+            session['line_profiler'] = LineProfiler()
+        except ImportError:
+            logging.warning("line_profiler is not installed , line level timings are skipped")
+
+    for stage in stages:
+        original = getattr(module, stage, None)
+        if original is None:
+            logging.warning(f"There is no function called {stage} to profile")
+            continue
+        session['originals'][stage] = original
+        function = original
+        if session['line_profiler'] is not None:
+            function = session['line_profiler'](original)
+        setattr(module, stage, profile_stage(session, stage, function))
+
+    session['sampler'].start()
+    logging.info(f"Profiling started for stages {list(session['originals'])}")
+    return session
+
+
+def stop_profiling(session: dict, output_dir: str = 'logs', top_n: int = 25):
+    """
+    Stop profiling , restore the original functions and write into output_dir :
+        - profile_<stage>.prof : cProfile output of each stage (snakeviz , gprof2dot , flameprof)
+        - profile_stacks.collapsed : sampled stacks of all threads for flamegraph.pl or speedscope
+        - profile_hotspots.txt : wall time of the stages and the top_n hotspots of each stage
+        - profile_lines.txt : line by line timings (only with line_level)
+    """
+    try:
+        session['sampler'].stop()
+        for stage, original in session['originals'].items():
+            setattr(session['module'], stage, original)
+
+        os.makedirs(output_dir, exist_ok=True)
+        session['sampler'].write_collapsed(os.path.join(output_dir, 'profile_stacks.collapsed'))
+
+        summary = io.StringIO()
+        summary.write("Wall time of the profiled stages\n")
+        for stage, timings in session['timings'].items():
+            summary.write(f"    {stage} : {len(timings)} calls , {sum(timings):.3f} seconds\n")
+
+        for stage, stats in session['stats'].items():
+            stats.dump_stats(os.path.join(output_dir, f"profile_{stage}.prof"))
+            summary.write(f"\n\nTop {top_n} hotspots of {stage} by own time\n")
+            stats.stream = summary
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(top_n)
+
+        with open(os.path.join(output_dir, 'profile_hotspots.txt'), 'w') as summary_file:
+            summary_file.write(summary.getvalue())
+
+        if session['line_profiler'] is not None:
+            with open(os.path.join(output_dir, 'profile_lines.txt'), 'w') as lines_file:
+                session['line_profiler'].print_stats(stream=lines_file)
+
+        logging.info(f"Profiling results are written into {output_dir}")
+
+    except Exception as e :
+        logging.error(f"Error occured during executing function (stop_profiling) : {e}")
@@ -0,0 +1,154 @@
+import logging
+import warnings
+import pandas as pd
+import numpy as np
+from typing import Tuple
+
+ALL_LABEL = 'All'
+
+
+def build_daily_counts(
+    df: pd.DataFrame,
+    date_col: str = 'crash_date',
+    borough_col: str = 'BoroName',
+    severity_col: str = 'severity'
+    ) -> Tuple[pd.DatetimeIndex, list, list, np.ndarray]:
+    """
+    Collapse the crashes into one small array of daily counts , done once so every
+    statistic after it works on days instead of the raw rows.
+
+    Args:
+        df: cleaned and merged crashes DataFrame
+        date_col: Name of the crash date column (default: 'crash_date')
+        borough_col: Name of the borough column (default: 'BoroName')
+        severity_col: Name of the severity column (default: 'severity')
+
+    Returns:
+        dates: every calendar day between the first and the last crash (days without crashes count 0)
+        boroughs: borough labels , the last one is 'All'
+        severities: severity labels , the last one is 'All'
+        counts: array of shape (days, boroughs, severities) with the totals on the 'All' slots
+                (estimated counts when the data is a preview sample with sample_weight)
+    """
+    crash_dates = pd.to_datetime(df[date_col]).dt.normalize()
+    dates = pd.date_range(crash_dates.min(), crash_dates.max(), freq='D')
+
+    day_codes = dates.get_indexer(crash_dates)
+    borough_codes, boroughs = pd.factorize(df[borough_col].astype('object'), sort=True)
+    severity_codes, severities = pd.factorize(df[severity_col].astype('object'), sort=True)
+
+    valid = (day_codes >= 0) & (borough_codes >= 0) & (severity_codes >= 0)
+    shape = (len(dates), len(boroughs), len(severities))
+    flat_codes = np.ravel_multi_index((day_codes[valid], borough_codes[valid], severity_codes[valid]), shape)
+    # preview samples are counted with their weights so the counts estimate the full data
+    weights = df['sample_weight'].to_numpy(dtype=float)[valid] if 'sample_weight' in df.columns else None
+    counts = np.bincount(flat_codes, weights=weights, minlength=int(np.prod(shape))).reshape(shape)
+
+    # adding the totals as an extra borough and an extra severity
+    counts = np.concatenate([counts, counts.sum(axis=1, keepdims=True)], axis=1)
+    counts = np.concatenate([counts, counts.sum(axis=2, keepdims=True)], axis=2)
+
+    return dates, list(boroughs) + [ALL_LABEL], list(severities) + [ALL_LABEL], counts
+
+
+def matched_baseline_days(dates: pd.DatetimeIndex, holiday_days: np.ndarray, is_holiday: np.ndarray) -> np.ndarray:
+    """
+    Normal days matching the holiday occurrences : same weekday , same month and same year
+    as one of the occurrences and not a public holiday themselves.
+    """
+    holiday_dates = dates[holiday_days]
+    matches = pd.MultiIndex.from_arrays([holiday_dates.year, holiday_dates.month, holiday_dates.dayofweek])
+    all_days = pd.MultiIndex.from_arrays([dates.year, dates.month, dates.dayofweek])
+    return np.flatnonzero(all_days.isin(matches) & ~is_holiday)
+
+
+def holiday_effect_statistics(
+    df: pd.DataFrame,
+    n_resamples: int = 5000,
+    confidence: float = 0.95,
+    seed: int = 42
+    ) -> pd.DataFrame:
+    """
+    Compare each public holiday with normal days of the same weekday and month ,
+    by borough and severity , using rate ratios with bootstrap confidence intervals.
+
+    The bootstrap resamples holiday days and baseline days from the daily counts array
+    in one batch of indices per holiday , so every borough x severity series is resampled together.
+    A holiday seen on a single day (one year runs) has its counts resampled as Poisson instead.
+
+    Args:
+        df: cleaned and merged crashes DataFrame (with holiday_name , BoroName and severity)
+        n_resamples: number of bootstrap resamples (default: 5000)
+        confidence: confidence level of the intervals (default: 0.95)
+        seed: seed of the random generator so the results are reproducible (default: 42)
+
+    Returns:
+        DataFrame with one row per holiday x borough x severity
+    """
+    try:
+        dates, boroughs, severities, counts = build_daily_counts(df)
+        n_days = len(dates)
+        # flattening boroughs x severities so each column is one daily series
+        series = counts.reshape(n_days, -1).astype(float)
+        labels = pd.MultiIndex.from_product([boroughs, severities], names=['borough', 'severity'])
+
+        holiday_days = df.dropna(subset=['holiday_name'])[['crash_date', 'holiday_name']].drop_duplicates()
+        holiday_positions = dates.get_indexer(pd.to_datetime(holiday_days['crash_date']).dt.normalize())
+        is_holiday = np.zeros(n_days, dtype=bool)
+        is_holiday[holiday_positions[holiday_positions >= 0]] = True
+
+        rng = np.random.default_rng(seed)
+        alpha = (1 - confidence) / 2
+        results = []
+        for holiday_name, group in holiday_days.groupby('holiday_name'):
+            days = np.unique(dates.get_indexer(pd.to_datetime(group['crash_date']).dt.normalize()))
+            days = days[days >= 0]
+            baseline = matched_baseline_days(dates, days, is_holiday)
+            if len(days) == 0 or len(baseline) == 0:
+                logging.warning(f"No matched baseline days for holiday {holiday_name}")
+                continue
+
+            holiday_series = series[days]
+            baseline_series = series[baseline]
+            holiday_mean = holiday_series.mean(axis=0)
+            baseline_mean = baseline_series.mean(axis=0)
+
+            # batched resampling : (resamples, days) indices -> (resamples, series) means
+            if len(days) >= 2:
+                holiday_samples = holiday_series[rng.integers(0, len(days), size=(n_resamples, len(days)))].mean(axis=1)
+            else:
+                # a single holiday day always resamples to itself , its counts are drawn as Poisson instead
+                logging.info(f"Holiday {holiday_name} has a single day , its counts are resampled as Poisson")
+                holiday_samples = rng.poisson(holiday_mean, size=(n_resamples, holiday_mean.size)).astype(float)
+            baseline_samples = baseline_series[rng.integers(0, len(baseline), size=(n_resamples, len(baseline)))].mean(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate_ratio = holiday_mean / baseline_mean
+                ratio_samples = holiday_samples / baseline_samples
+            # series without baseline crashes (often Fatal) have no ratio , kept as NaN in the table too
+            rate_ratio[~np.isfinite(rate_ratio)] = np.nan
+            ratio_samples[~np.isfinite(ratio_samples)] = np.nan
+            # series where every ratio is NaN give NaN intervals , without the All-NaN slice warning
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                ci_low, ci_high = np.nanquantile(ratio_samples, [alpha, 1 - alpha], axis=0)
+
+            results.append(pd.DataFrame({
+                'holiday_name': holiday_name,
+                'borough': labels.get_level_values('borough'),
+                'severity': labels.get_level_values('severity'),
+                'holiday_days': len(days),
+                'baseline_days': len(baseline),
+                'holiday_mean_daily': holiday_mean,
+                'baseline_mean_daily': baseline_mean,
+                'rate_ratio': rate_ratio,
+                'ci_low': ci_low,
+                'ci_high': ci_high,
+            }))
+
+        statistics = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+        logging.info(f"Holiday effect statistics computed for {len(results)} holidays with {n_resamples} resamples")
+        return statistics
+
+    except Exception as e :
+        logging.error(f"Error occured during executing function (holiday_effect_statistics) : {e}")
+        return pd.DataFrame()